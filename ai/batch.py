@@ -0,0 +1,146 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
+from uuid import UUID
+
+from pydantic import BaseModel, validator
+from rich.console import Console
+from tqdm import tqdm
+
+from ai.open_ai import (EMBEDDING_BATCH_SIZE, ChatMessage,
+                        build_initial_system_message, build_user_message,
+                        create_chat_completion, create_embedding,
+                        create_embedding_batch)
+from core.config import load_max_tokens, load_selected_model
+from data.query import match_file_sections_across_projects
+from repository.projects import get_projects_by_pattern
+
+console = Console()
+
+MAX_IN_FLIGHT_REQUESTS = 4
+
+
+class BatchQuestion(BaseModel):
+    id: Optional[str] = None
+    question: str
+
+    @validator("question")
+    def question_is_not_empty(cls, question: str) -> str:
+        if not question.strip():
+            raise ValueError("question must not be empty")
+        return question
+
+
+class BatchAnswer(BaseModel):
+    id: Optional[str] = None
+    question: str
+    answer: Optional[str] = None
+    error: Optional[str] = None
+    latency: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+
+
+def read_batch_questions(input_path: str) -> List[BatchQuestion]:
+    """Read the questions from a JSONL file, one `{"id": ..., "question": ...}` object per line."""
+    questions = []
+    with open(input_path, "r", encoding="utf-8") as input_file:
+        for line_number, line in enumerate(input_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                questions.append(BatchQuestion(**json.loads(line)))
+            except Exception as ex:
+                raise ValueError(f"Invalid question on line {line_number} of {input_path}: {ex}") from ex
+    return questions
+
+
+def query_llm_batch(project_name: str, input_path: str, output_path: str, concurrency: int = MAX_IN_FLIGHT_REQUESTS):
+    """Answer every question of the input file and write the answers to the output file in the same order.
+
+    All questions are embedded up front in batched requests, then retrieval and the ChatCompletion for each
+    question run in a pool of `concurrency` workers, so at most that many completions are in flight at once.
+    """
+    projects = get_projects_by_pattern(project_name)
+    if not projects:
+        return
+    project_ids = [project.id for project in projects]
+    questions = read_batch_questions(input_path)
+    project_names = ", ".join(project.name for project in projects)
+    console.print(f"Answering {len(questions)} questions for projects - {project_names}")
+
+    model = load_selected_model()
+    max_tokens = load_max_tokens()
+    system_message = build_initial_system_message()
+    query_embeddings = embed_questions(questions)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, open(output_path, "w", encoding="utf-8") as output:
+        futures = [
+            executor.submit(answer_question, project_ids, model, max_tokens, system_message, question, query_embedding)
+            for question, query_embedding in zip(questions, query_embeddings)
+        ]
+        # Futures are consumed in submission order, so answers are written in order as soon as they are ready
+        for future in tqdm(futures, desc="Answering"):
+            output.write(future.result().json() + "\n")
+            output.flush()
+    console.print(f"Answers written to {output_path}")
+
+
+def embed_questions(questions: List[BatchQuestion]) -> List[Union[List[float], Exception]]:
+    """Embed the questions in batches, falling back to one request per question for the batches that fail.
+
+    A question that cannot be embedded gets the exception in place of its embedding, so only that answer fails.
+    """
+    texts = [question.question for question in questions]
+    embeddings = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+        try:
+            embeddings.extend(create_embedding_batch(batch))
+        except Exception as ex:
+            logging.error(f"Unable to embed questions {start + 1} to {start + len(batch)} together: {ex}")
+            for text in batch:
+                try:
+                    embeddings.append(create_embedding(text))
+                except Exception as question_ex:
+                    embeddings.append(question_ex)
+    return embeddings
+
+
+def answer_question(
+    project_ids: List[UUID],
+    model: str,
+    max_tokens: int,
+    system_message: ChatMessage,
+    question: BatchQuestion,
+    query_embedding: Union[List[float], Exception],
+) -> BatchAnswer:
+    start = time.perf_counter()
+    try:
+        if isinstance(query_embedding, Exception):
+            raise query_embedding
+        match_results = match_file_sections_across_projects(project_ids, query_embedding)
+        user_message, _ = build_user_message(question.question, match_results, max_tokens)
+        messages = [system_message, user_message]
+        response = create_chat_completion(model, messages)
+        usage = response["usage"]
+        return BatchAnswer(
+            id=question.id,
+            question=question.question,
+            answer=response["choices"][0]["message"]["content"],
+            latency=time.perf_counter() - start,
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            total_tokens=usage["total_tokens"],
+        )
+    except Exception as ex:
+        logging.error(f"Unable to answer question - {question.question}: {ex}")
+        return BatchAnswer(
+            id=question.id,
+            question=question.question,
+            error=str(ex),
+            latency=time.perf_counter() - start,
+        )
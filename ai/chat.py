@@ -0,0 +1,136 @@
+import logging
+from typing import List, Set, Tuple
+from uuid import UUID
+
+from halo import Halo
+from pydantic import BaseModel
+from rich.console import Console
+from rich.markdown import Markdown
+
+from ai.open_ai import (ChatMessage, build_initial_system_message,
+                        build_user_message, create_chat_completion,
+                        create_embedding)
+from ai.tokens import count_tokens
+from core.config import load_max_tokens, load_selected_model
+from data.query import MatchResult, match_file_sections_across_projects
+from repository.projects import get_projects_by_pattern
+
+console = Console()
+
+EXIT_COMMANDS = ("exit", "quit")
+ANSWER_RESERVED_TOKENS = 1000
+FOLLOW_UP_CONTEXT_TOKENS = 1500
+
+
+class ChatTurn(BaseModel):
+    query: str
+    messages: List[ChatMessage]
+    section_keys: List[Tuple[UUID, str]]
+    tokens: int
+
+
+class ChatSession:
+    """A conversation about one or more projects that keeps its history and retrieved sections between turns.
+
+    Sections already sent in a previous turn are not sent again, and follow-up questions only add up to
+    `FOLLOW_UP_CONTEXT_TOKENS` of new sections on top of them. When the history leaves no room for that and the
+    answer, the context of the oldest turns is dropped first (their sections can then be retrieved again), and
+    their questions and answers only once no context is left to drop.
+    """
+
+    def __init__(self, project_ids: List[UUID], model: str, max_tokens: int):
+        self.project_ids = project_ids
+        self.model = model
+        self.max_tokens = max_tokens
+        self.system_message = build_initial_system_message()
+        self.turns: List[ChatTurn] = []
+        self.section_keys: Set[Tuple[UUID, str]] = set()
+
+    def ask(self, query: str) -> Tuple[str, dict]:
+        query_tokens = count_tokens(query)
+        if self.turns:
+            history_tokens = self.trim_history(FOLLOW_UP_CONTEXT_TOKENS + ANSWER_RESERVED_TOKENS + query_tokens)
+            context_limit = FOLLOW_UP_CONTEXT_TOKENS
+        else:
+            history_tokens = count_tokens(self.system_message.content)
+            context_limit = self.max_tokens
+        available_tokens = self.max_tokens - history_tokens - ANSWER_RESERVED_TOKENS - query_tokens
+        context_tokens = max(0, min(context_limit, available_tokens))
+        match_results = match_file_sections_across_projects(
+            self.project_ids, create_embedding(query), self.section_keys
+        )
+        user_message, included_results = build_user_message(query, match_results, context_tokens)
+        turn = ChatTurn(
+            query=query,
+            messages=[user_message],
+            section_keys=[section_key for match in included_results for section_key in section_keys(match)],
+            tokens=count_tokens(user_message.content),
+        )
+
+        history = [message for past in self.turns for message in past.messages]
+        response = create_chat_completion(self.model, [self.system_message] + history + [user_message])
+        answer = response["choices"][0]["message"]["content"]
+
+        turn.messages.append(ChatMessage(role="assistant", content=answer))
+        turn.tokens += count_tokens(answer)
+        self.turns.append(turn)
+        self.section_keys.update(turn.section_keys)
+        return answer, response["usage"]
+
+    def trim_history(self, reserved_tokens: int) -> int:
+        """Trim the oldest turns until the history leaves `reserved_tokens` free and return its token count."""
+        history_tokens = count_tokens(self.system_message.content) + sum(turn.tokens for turn in self.turns)
+        for turn in self.turns:
+            if history_tokens + reserved_tokens <= self.max_tokens:
+                break
+            history_tokens -= self.drop_context(turn)
+        while self.turns and history_tokens + reserved_tokens > self.max_tokens:
+            oldest = self.turns.pop(0)
+            history_tokens -= oldest.tokens
+            self.section_keys.difference_update(oldest.section_keys)
+        return history_tokens
+
+    def drop_context(self, turn: ChatTurn) -> int:
+        """Replace the question of a turn with the bare question without its context and return the tokens saved."""
+        if turn.messages[0].content == turn.query:
+            return 0
+        saved_tokens = count_tokens(turn.messages[0].content) - count_tokens(turn.query)
+        turn.messages[0] = ChatMessage(role="user", content=turn.query)
+        turn.tokens -= saved_tokens
+        self.section_keys.difference_update(turn.section_keys)
+        turn.section_keys = []
+        return saved_tokens
+
+
+def section_keys(match: MatchResult) -> List[Tuple[UUID, str]]:
+    return [(match.project_id, content_hash) for content_hash in match.content_hashes]
+
+
+def chat_llm(project_name: str):
+    projects = get_projects_by_pattern(project_name)
+    if not projects:
+        return
+    session = ChatSession([project.id for project in projects], load_selected_model(), load_max_tokens())
+    console.print(f"Chatting about {', '.join(project.name for project in projects)}. Type `exit` to quit.\n")
+    while True:
+        try:
+            query = console.input("[bold green]> [/bold green]").strip()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if query.lower() in EXIT_COMMANDS:
+            break
+        if not query:
+            continue
+        try:
+            with Halo(text='Loading response', spinner='dots'):
+                answer, usage = session.ask(query)
+        except KeyboardInterrupt:
+            console.print("Cancelled.\n")
+            continue
+        except Exception as e:
+            logging.error("Unable to generate ChatCompletion response due to the following exception:")
+            logging.error(f"Exception: {e}")
+            continue
+        console.print(Markdown(answer))
+        console.print(f"Prompt tokens: {usage['prompt_tokens']}, completion tokens: {usage['completion_tokens']}\n",
+                      style="dim")
@@ -1,6 +1,6 @@
 import logging
 from io import StringIO
-from typing import List
+from typing import List, Optional, Tuple
 from uuid import UUID
 
 import openai
@@ -13,13 +13,15 @@ from tenacity import retry, stop_after_attempt, wait_random_exponential
 
 from ai.tokens import count_tokens
 from core.config import load_max_tokens, load_selected_model
-from data.query import MatchResult, match_file_sections
-from repository.projects import get_project_by_name
+from data.query import MatchResult, match_file_sections_across_projects
+from repository.projects import get_projects_by_pattern
 
 console = Console()
 
 MAX_TOKENS = 7500
 
+EMBEDDING_BATCH_SIZE = 100
+
 class ChatMessage(BaseModel):
     role: str
     content: str
@@ -41,6 +43,20 @@ def create_embedding(text) :
         return embedding
     return None
 
+@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
+def create_embedding_batch(texts: List[str]) -> List:
+    response = openai.Embedding.create(input=texts, model="text-embedding-ada-002")
+    return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
+
+
+@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
+def create_chat_completion(model: str, messages: List[ChatMessage]):
+    return openai.ChatCompletion.create(
+        model=model,
+        messages=[message.dict() for message in messages],
+        temperature=0,
+    )
+
 def get_available_models() -> List:
     token_mapping = {"16k": 14000, "32k": 30000}
     return [
@@ -54,11 +70,12 @@ def get_available_models() -> List:
 
 
 def query_llm(project_name: str, query: str):
-    project = get_project_by_name(project_name)
-    if project is None:
+    projects = get_projects_by_pattern(project_name)
+    if not projects:
         return
     else:
-        messages = [build_initial_system_message(), build_initial_user_message(project.id, query)]
+        project_ids = [project.id for project in projects]
+        messages = [build_initial_system_message(), build_initial_user_message(project_ids, query)]
         buffer = StringIO()
         with Halo(text='Loading response', spinner='dots'):
             try:
@@ -102,10 +119,18 @@ def build_initial_system_message() -> ChatMessage:
     return ChatMessage(role="system", content=system_message)
 
 
-def build_initial_user_message(project_id: UUID, query: str) -> ChatMessage:
+def build_initial_user_message(project_ids: List[UUID], query: str) -> ChatMessage:
     query_embedding = create_embedding(query)
-    match_results = match_file_sections(project_id, query_embedding)
-    context = build_context_text(match_results)
+    match_results = match_file_sections_across_projects(project_ids, query_embedding)
+    user_message, _ = build_user_message(query, match_results)
+    return user_message
+
+
+def build_user_message(
+    query: str, match_results: List[MatchResult], max_tokens: Optional[int] = None
+) -> Tuple[ChatMessage, List[MatchResult]]:
+    """Build the user message and return it along with the matches that fit in its context."""
+    context, included_results = build_context_text(match_results, max_tokens)
     content = (
         "Context sections:\n"
         f"{context}\n\n"
@@ -115,16 +140,22 @@ def build_initial_user_message(project_id: UUID, query: str) -> ChatMessage:
         "relative links or relative image paths, since these will not load. However, you can "
         "include absolute links and image paths."
     ).strip()
-    return ChatMessage(role="user", content=content)
+    return ChatMessage(role="user", content=content), included_results
 
 
-def build_context_text(file_sections: List[MatchResult]) -> str:
+def build_context_text(
+    file_sections: List[MatchResult], max_tokens: Optional[int] = None
+) -> Tuple[str, List[MatchResult]]:
     context_text = ""
+    included_sections = []
     context_token_count = 0
-    max_tokens = load_max_tokens()
+    if max_tokens is None:
+        max_tokens = load_max_tokens()
     for file_section in file_sections:
         context_token_count += count_tokens(file_section.content)
         if context_token_count >= max_tokens:
             break
-        context_text += f"\n---\n// File path: {file_section.path}\n{file_section.content}\n---\n"
-    return context_text
+        file_paths = "\n".join(f"// File path: {path}" for path in file_section.paths)
+        context_text += f"\n---\n{file_paths}\n{file_section.content}\n---\n"
+        included_sections.append(file_section)
+    return context_text, included_sections
@@ -5,12 +5,14 @@ import typer
 from rich.console import Console
 from rich.logging import RichHandler
 
+from ai.batch import MAX_IN_FLIGHT_REQUESTS, query_llm_batch
+from ai.chat import chat_llm
 from ai.open_ai import get_available_models, query_llm
 from core.config import (CONFIG_FILE_PATH,
                          create_or_update_with_default_config,
                          save_selected_model)
 from data.database import create_tables_if_not_exists
-from repository import projects
+from repository import projects, snapshots
 
 logging.basicConfig(
     level=logging.ERROR,
@@ -64,7 +66,8 @@ def select_model():
 @app.command()
 def query(project_name: str, query: str):
     """
-    Query your codebase. Provide the project name (you can list all projects with `gpt-code-assistant list-projects`)
+    Query your codebase. Provide the project name (you can list all projects with `gpt-code-assistant list-projects`),
+    a comma separated list of names or a glob pattern such as `service-*` to search several projects at once.
     """
     if not check_openai_key():
         return
@@ -72,6 +75,39 @@ def query(project_name: str, query: str):
     query_llm(project_name, query)
 
 
+@app.command()
+def chat(project_name: str):
+    """
+    Start an interactive chat about your codebase that remembers the previous questions and answers.
+    """
+    if not check_openai_key():
+        return
+
+    chat_llm(project_name)
+
+
+@app.command()
+def query_batch(
+    project_name: str,
+    input_path: str,
+    output_path: str,
+    concurrency: int = typer.Option(MAX_IN_FLIGHT_REQUESTS, help="Maximum number of ChatCompletions in flight."),
+):
+    """
+    Answer every question of a JSONL file (one `{"id": ..., "question": ...}` per line) and write the answers,
+    latency and token usage to an output JSONL file in the same order.
+    """
+    if not check_openai_key():
+        return
+
+    if not os.path.exists(input_path):
+        raise typer.BadParameter(f"Input file {input_path} does not exist. Please enter a valid path.")
+    try:
+        query_llm_batch(project_name, input_path, output_path, concurrency)
+    except ValueError as ex:
+        raise typer.BadParameter(str(ex)) from ex
+
+
 @app.command()
 def create_project(name: str, path: str):
     """
@@ -97,6 +133,40 @@ def refresh_project(name: str):
     """
     projects.reindex_project(name)
 
+@app.command()
+def resume(name: str):
+    """
+    Resume an interrupted indexing run of a project without re-embedding what was already indexed.
+    """
+    projects.resume_project(name)
+
+@app.command()
+def export_index(name: str, output_path: str):
+    """
+    Export a project's files, sections and embeddings to a single snapshot file that can be shared.
+    """
+    snapshots.export_project_index(name, output_path)
+
+
+@app.command()
+def import_index(
+    input_path: str,
+    path: str,
+    name: str = typer.Option(None, help="Project name, defaults to the name of the exported project."),
+):
+    """
+    Create a project from a snapshot file without re-embedding it. Provide the path of the codebase on this machine.
+    """
+    if not os.path.exists(input_path):
+        raise typer.BadParameter(f"Snapshot {input_path} does not exist. Please enter a valid path.")
+    absolute_path = os.path.abspath(path)
+    if not os.path.exists(absolute_path):
+        raise typer.BadParameter(f"Path {absolute_path} does not exist. Please enter a valid path.")
+    try:
+        snapshots.import_project_index(input_path, absolute_path, name)
+    except ValueError as ex:
+        raise typer.BadParameter(str(ex)) from ex
+
 @app.command()
 def list_projects():
     """
@@ -110,7 +180,13 @@ def callback(ctx: typer.Context):
         console.print("Creating default config file...")
         create_or_update_with_default_config()
 
-    create_tables_if_not_exists()
+    added_columns = create_tables_if_not_exists()
+    if "file_sections.content_hash" in added_columns:
+        console.print(
+            "The index format changed and existing embeddings can no longer be found. "
+            "Please run `gpt-code-assistant refresh-project <project-name>` for each of your projects.",
+            style="bold red",
+        )
 
     if ctx.invoked_subcommand is None:
         typer.main.get_command(app).get_help(ctx)
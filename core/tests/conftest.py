@@ -0,0 +1,7 @@
+import os
+
+# The chroma embedding function of `data.chroma` needs an API key when it is imported, the tests never call the API
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+# Import the modules in the same order as the CLI, importing `data.query` before `ai.open_ai` is circular
+import ai.open_ai  # noqa: E402,F401
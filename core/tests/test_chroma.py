@@ -0,0 +1,142 @@
+import pytest
+
+from data.chroma import FileSectionEmbeddingWriter
+
+
+@pytest.fixture
+def collection(mocker):
+    return mocker.patch("data.chroma.get_file_section_collection").return_value
+
+
+@pytest.fixture
+def checkpoint(mocker):
+    return mocker.Mock()
+
+
+@pytest.fixture
+def writer(collection, checkpoint):
+    # Nothing is flushed unless a test flushes explicitly
+    return FileSectionEmbeddingWriter("project", checkpoint, max_batch_size=100, max_delay=3600)
+
+
+def test_claim_is_only_granted_once(writer):
+    assert writer.claim("hash")
+    assert not writer.claim("hash")
+
+
+def test_checkpoints_wait_for_the_flush_that_writes_the_embedding(writer, collection, checkpoint):
+    assert writer.claim("hash")
+    assert not writer.claim("hash")
+    writer.checkpoint_section("duplicate-file", "duplicate-section", "hash")
+    writer.complete_file("duplicate-file", ["hash"])
+    writer.flush()
+    checkpoint.assert_not_called()
+
+    writer.upsert("hash", [0.1, 0.2])
+    writer.checkpoint_section("owner-file", "owner-section", "hash")
+    writer.complete_file("owner-file", ["hash"])
+    writer.flush()
+
+    collection.upsert.assert_called_once_with(ids=["hash"], embeddings=[[0.1, 0.2]])
+    checkpoint.assert_called_once_with(["duplicate-section", "owner-section"], ["duplicate-file", "owner-file"])
+    assert writer.failed_files == set()
+
+
+def test_checkpoints_without_pending_embeddings_are_written_on_the_next_flush(writer, collection, checkpoint):
+    writer.checkpoint_section("file", "section", "stored-hash")
+    writer.complete_file("file", ["stored-hash"])
+    writer.flush()
+
+    collection.upsert.assert_not_called()
+    checkpoint.assert_called_once_with(["section"], ["file"])
+
+
+def test_release_fails_the_files_waiting_on_the_claim(writer, checkpoint):
+    assert writer.claim("hash")
+    writer.checkpoint_section("waiting-file", "waiting-section", "hash")
+    writer.complete_file("waiting-file", ["hash"])
+
+    writer.release("hash")
+    # A file that only starts waiting once the claim was released fails too
+    writer.checkpoint_section("late-file", "late-section", "hash")
+    writer.flush()
+
+    checkpoint.assert_not_called()
+    assert writer.failed_files == {"waiting-file", "late-file"}
+
+
+def test_released_embedding_can_be_claimed_again(writer, checkpoint):
+    assert writer.claim("hash")
+    writer.release("hash")
+
+    assert writer.claim("hash")
+    writer.checkpoint_section("file", "section", "hash")
+    writer.upsert("hash", [0.1])
+    writer.flush()
+
+    checkpoint.assert_called_once_with(["section"], [])
+    assert writer.failed_files == set()
+
+
+def test_failed_upsert_fails_every_file_waiting_on_the_batch(mocker, writer, checkpoint):
+    upsert = mocker.patch("data.chroma.upsert_file_section_embeddings", side_effect=RuntimeError("chroma is down"))
+    assert writer.claim("hash")
+    writer.checkpoint_section("owner-file", "owner-section", "hash")
+    writer.checkpoint_section("duplicate-file", "duplicate-section", "hash")
+    writer.checkpoint_section("other-file", "other-section", "stored-hash")
+    writer.upsert("hash", [0.1])
+
+    writer.flush()
+
+    upsert.assert_called_once()
+    checkpoint.assert_called_once_with(["other-section"], [])
+    assert writer.failed_files == {"owner-file", "duplicate-file"}
+    # The owner has already upserted when the flush of another worker fails
+    writer.complete_file("owner-file", ["hash"])
+    writer.checkpoint_section("late-file", "late-section", "hash")
+    assert writer.failed_files == {"owner-file", "duplicate-file", "late-file"}
+    assert writer.claim("hash")
+
+
+def test_failed_delete_does_not_fail_the_flush(mocker, writer, checkpoint):
+    mocker.patch("data.chroma.delete_file_section_embeddings", side_effect=RuntimeError("chroma is down"))
+    writer.delete("stale-hash")
+    writer.checkpoint_section("file", "section", "stored-hash")
+
+    writer.flush()
+
+    checkpoint.assert_called_once_with(["section"], [])
+    assert writer.failed_files == set()
+
+
+def test_failed_checkpoint_fails_its_files(writer, checkpoint):
+    checkpoint.side_effect = RuntimeError("database is locked")
+    writer.checkpoint_section("file", "section", "stored-hash")
+
+    writer.flush()
+
+    assert writer.failed_files == {"file"}
+
+
+def test_failed_file_is_never_completed(writer, checkpoint):
+    assert writer.claim("hash")
+    writer.checkpoint_section("file", "section", "hash")
+    writer.fail_file("file")
+    writer.complete_file("file", ["hash"])
+    writer.upsert("hash", [0.1])
+
+    writer.flush()
+
+    checkpoint.assert_not_called()
+    assert writer.failed_files == {"file"}
+
+
+def test_deletes_are_written_in_batches(collection):
+    writer = FileSectionEmbeddingWriter("project", lambda *_: None, max_batch_size=2, max_delay=3600)
+    with writer:
+        for number in range(3):
+            writer.delete(f"stale-{number}")
+
+    batches = [call.kwargs["ids"] for call in collection.delete.call_args_list]
+    assert sorted(len(batch) for batch in batches) == [1, 2]
+    assert {content_hash for batch in batches for content_hash in batch} == {"stale-0", "stale-1", "stale-2"}
@@ -0,0 +1,77 @@
+import uuid
+
+import numpy as np
+
+from data.query import MatchResult, maximal_marginal_relevance, merge_adjacent_matches, normalize
+
+PROJECT_ID = uuid.uuid4()
+
+
+def match(path: str, position: int, similarity: float, content_hash: str, project_id=PROJECT_ID) -> MatchResult:
+    return MatchResult(
+        project_id=project_id,
+        content_hashes=[content_hash],
+        path=path,
+        paths=[path],
+        similarity=similarity,
+        content=f"{content_hash}\n",
+        position=position,
+    )
+
+
+def test_mmr_picks_the_most_relevant_candidate_first():
+    embeddings = normalize(np.asarray([[1, 0], [0, 1], [1, 1]], dtype=np.float32))
+    relevance = np.asarray([0.2, 0.9, 0.5], dtype=np.float32)
+
+    assert maximal_marginal_relevance(relevance, embeddings, 1, 0.7)[0] == 1
+
+
+def test_mmr_prefers_a_diverse_candidate_over_a_near_duplicate():
+    embeddings = normalize(np.asarray([[1, 0], [1, 0.01], [0, 1]], dtype=np.float32))
+    relevance = np.asarray([0.9, 0.89, 0.6], dtype=np.float32)
+
+    assert maximal_marginal_relevance(relevance, embeddings, 2, 0.5) == [0, 2]
+    # Only relevance counts with a lambda of 1
+    assert maximal_marginal_relevance(relevance, embeddings, 2, 1) == [0, 1]
+
+
+def test_mmr_never_picks_more_candidates_than_available_or_twice_the_same():
+    embeddings = normalize(np.asarray([[1, 0], [0, 1], [1, 1]], dtype=np.float32))
+    relevance = np.asarray([0.3, 0.2, 0.1], dtype=np.float32)
+
+    assert sorted(maximal_marginal_relevance(relevance, embeddings, 10, 0.7)) == [0, 1, 2]
+
+
+def test_merge_joins_consecutive_sections_of_the_same_file():
+    merged = merge_adjacent_matches([match("a.py", 1, 0.8, "second"), match("a.py", 0, 0.7, "first")])
+
+    assert len(merged) == 1
+    assert merged[0].content == "first\nsecond\n"
+    assert merged[0].content_hashes == ["first", "second"]
+    assert merged[0].similarity == 0.8
+    assert merged[0].position == 1
+
+
+def test_merge_keeps_gaps_other_files_and_other_projects_apart():
+    matches = [
+        match("a.py", 0, 0.5, "a0"),
+        match("a.py", 2, 0.9, "a2"),
+        match("b.py", 1, 0.7, "b1"),
+        match("b.py", 2, 0.6, "other-project", project_id=uuid.uuid4()),
+    ]
+
+    merged = merge_adjacent_matches(matches)
+
+    assert [merged_match.content_hashes for merged_match in merged] == [["a2"], ["b1"], ["other-project"], ["a0"]]
+
+
+def test_merge_only_keeps_the_paths_shared_by_the_merged_sections():
+    first = match("a.py", 0, 0.8, "first")
+    first.paths = ["a.py", "copy.py"]
+    second = match("a.py", 1, 0.7, "second")
+
+    merged = merge_adjacent_matches([first, second])
+
+    assert merged[0].paths == ["a.py"]
+    # The matches passed in are left untouched
+    assert first.content == "first\n"
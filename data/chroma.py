@@ -1,9 +1,14 @@
+import logging
 import os
+import time
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 from uuid import UUID
 
 import chromadb
 from chromadb.config import Settings
 from chromadb.utils import embedding_functions
+from tenacity import retry, stop_after_attempt, wait_random_exponential
 from ai import open_ai
 
 from core.config import BASE_DIR
@@ -13,21 +18,214 @@ openai_embedding_function = embedding_functions.OpenAIEmbeddingFunction(api_key=
 
 client = chromadb.PersistentClient(path=f"{BASE_DIR}/chroma/", settings=Settings(anonymized_telemetry=False))
 
+FLUSH_BATCH_SIZE = 500
+FLUSH_INTERVAL_SECONDS = 5.0
+
+collections = {}
+collections_lock = Lock()
+
 def get_file_section_collection(project_id: UUID):
-    return client.get_or_create_collection(
-        str(project_id) + "-file_sections",
-        embedding_function=openai_embedding_function
-    )
+    name = str(project_id) + "-file_sections"
+    with collections_lock:
+        if name not in collections:
+            collections[name] = client.get_or_create_collection(name, embedding_function=openai_embedding_function)
+        return collections[name]
 
 def delete_all_file_section_embeddings(project_id: UUID):
     get_file_section_collection(project_id).delete()
 
-def create_file_section_embeddings(project_id: UUID, file_section_id: UUID, file_section: str):
+def get_file_section_embedding_ids(project_id: UUID) -> Set[str]:
+    """Content hashes of every embedding stored for the project, loaded in a single request."""
+    return set(get_file_section_collection(project_id).get(include=[])["ids"])
+
+@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3), reraise=True)
+def upsert_file_section_embeddings(collection, content_hashes: List[str], embeddings: List[List[float]]):
+    collection.upsert(ids=content_hashes, embeddings=embeddings)
+
+@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3), reraise=True)
+def delete_file_section_embeddings(collection, content_hashes: List[str]):
+    collection.delete(ids=content_hashes)
+
+def create_file_section_embeddings(writer: "FileSectionEmbeddingWriter", content_hash: str, file_section: str):
     embedding = open_ai.create_embedding(file_section)
-    get_file_section_collection(project_id).upsert(
-        ids=[str(file_section_id)],
-        embeddings=[embedding]
-    )
+    writer.upsert(content_hash, embedding)
+
+
+class FileSectionEmbeddingWriter:
+    """Buffers the embedding upserts and deletes of a project and writes them to chroma in large batches.
+
+    The buffer is flushed once it holds `max_batch_size` operations or `max_delay` seconds after the last flush,
+    and must be flushed explicitly at the end of a run. Sections and files registered with `checkpoint_section` and
+    `complete_file` become ready once the embeddings they wait on have been written, and each flush hands all the
+    ready ones to `checkpoint(file_section_ids, file_ids)` at once, which is how callers checkpoint progress.
+
+    Embeddings are claimed before they are created, so that the sections sharing a claimed embedding only get
+    checkpointed after the flush that writes it, even when its owner is still waiting on the embeddings API.
+    When the owner releases its claim instead, every file waiting on the embedding fails with it and ends up in
+    `failed_files` along with the files failed explicitly with `fail_file`. Chroma writes are retried, and the
+    files waiting on a batch that still cannot be written (or checkpointed) fail the same way.
+    """
+
+    def __init__(self, project_id: UUID, checkpoint: Callable[[List[str], List[str]], None],
+                 max_batch_size: int = FLUSH_BATCH_SIZE, max_delay: float = FLUSH_INTERVAL_SECONDS):
+        self.project_id = project_id
+        self.checkpoint = checkpoint
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.upserts: Dict[str, List[float]] = {}
+        self.deletes = set()
+        self.claimed = set()
+        self.pending = set()
+        # (file id, file section id or None for the file itself, content hashes still to be written)
+        self.waiting: List[Tuple[str, Optional[str], Set[str]]] = []
+        self.ready: List[Tuple[str, Optional[str]]] = []
+        self.failed_hashes = set()
+        self.failed_files = set()
+        self.last_flush = time.monotonic()
+        self.buffer_lock = Lock()
+        self.flush_lock = Lock()
+        self.checkpoint_lock = Lock()
+
+    def claim(self, content_hash: str) -> bool:
+        """Claim the embedding of a content hash, returns False when another section already claimed it.
+
+        The owner of a claim must either `upsert` the embedding or `release` the claim.
+        """
+        with self.buffer_lock:
+            if content_hash in self.claimed:
+                return False
+            self.claimed.add(content_hash)
+            self.failed_hashes.discard(content_hash)
+            self.pending.add(content_hash)
+            return True
+
+    def release(self, content_hash: str):
+        """Give up a claim without writing its embedding, the files waiting on it fail."""
+        with self.buffer_lock:
+            self.claimed.discard(content_hash)
+            self.pending.discard(content_hash)
+            self.failed_hashes.add(content_hash)
+            self.fail_files({file_id for file_id, _, waiting_hashes in self.waiting if content_hash in waiting_hashes})
+
+    def fail_file(self, file_id: str):
+        """Drop everything still waiting to be checkpointed for a file, it will not be completed."""
+        with self.buffer_lock:
+            self.fail_files({file_id})
+
+    def fail_files(self, file_ids: Set[str]):
+        # Must be called with the buffer lock held
+        self.failed_files.update(file_ids)
+        self.waiting = [entry for entry in self.waiting if entry[0] not in file_ids]
+
+    def upsert(self, content_hash: str, embedding: List[float]):
+        with self.buffer_lock:
+            self.deletes.discard(content_hash)
+            self.upserts[content_hash] = embedding
+        self.flush_if_needed()
+
+    def delete(self, content_hash: str):
+        with self.buffer_lock:
+            self.upserts.pop(content_hash, None)
+            self.deletes.add(content_hash)
+        self.flush_if_needed()
+
+    def checkpoint_section(self, file_id: str, file_section_id: str, content_hash: str):
+        """Checkpoint a section once its embedding has been written."""
+        self.wait_for(file_id, file_section_id, [content_hash])
+
+    def complete_file(self, file_id: str, content_hashes: Iterable[str]):
+        """Checkpoint a file as completed once the embeddings of all its sections have been written."""
+        self.wait_for(file_id, None, content_hashes)
+
+    def wait_for(self, file_id: str, file_section_id: Optional[str], content_hashes: Iterable[str]):
+        content_hashes = set(content_hashes)
+        with self.buffer_lock:
+            if file_id in self.failed_files:
+                return
+            if not self.failed_hashes.isdisjoint(content_hashes):
+                # The section claiming the embedding failed before this one got to wait on it
+                self.fail_files({file_id})
+                return
+            waiting_hashes = self.pending.intersection(content_hashes)
+            if waiting_hashes:
+                self.waiting.append((file_id, file_section_id, waiting_hashes))
+            else:
+                self.ready.append((file_id, file_section_id))
+        self.flush_if_needed()
+
+    def flush_if_needed(self):
+        with self.buffer_lock:
+            pending = len(self.upserts) + len(self.deletes)
+            expired = time.monotonic() - self.last_flush >= self.max_delay
+            waiting = pending > 0 or len(self.ready) > 0
+        if pending >= self.max_batch_size or (waiting and expired):
+            self.flush()
+
+    def flush(self):
+        # Flushes are serialized so that batches reach chroma in the order they were buffered
+        with self.flush_lock:
+            with self.buffer_lock:
+                upserts, self.upserts = self.upserts, {}
+                deletes, self.deletes = self.deletes, set()
+                self.last_flush = time.monotonic()
+            collection = get_file_section_collection(self.project_id)
+            delete_ids = list(deletes)
+            for start in range(0, len(delete_ids), self.max_batch_size):
+                batch_ids = delete_ids[start:start + self.max_batch_size]
+                try:
+                    delete_file_section_embeddings(collection, batch_ids)
+                except Exception as ex:
+                    # Nothing waits on a delete, the unused embedding is swept again at the end of the next run
+                    logging.error(f"Unable to delete {len(batch_ids)} embeddings: {ex}")
+            ids = list(upserts)
+            failed_hashes = set()
+            for start in range(0, len(ids), self.max_batch_size):
+                batch_ids = ids[start:start + self.max_batch_size]
+                try:
+                    upsert_file_section_embeddings(collection, batch_ids, [upserts[id] for id in batch_ids])
+                except Exception as ex:
+                    logging.error(f"Unable to write {len(batch_ids)} embeddings, the files waiting on them fail: {ex}")
+                    failed_hashes.update(batch_ids)
+            with self.buffer_lock:
+                self.pending.difference_update(upserts)
+                # A later section with the same content can claim and create a failed embedding again
+                self.claimed.difference_update(failed_hashes)
+                self.failed_hashes.update(failed_hashes)
+                self.fail_files({
+                    file_id
+                    for file_id, _, waiting_hashes in self.waiting
+                    if not waiting_hashes.isdisjoint(failed_hashes)
+                })
+                still_waiting = []
+                for file_id, file_section_id, waiting_hashes in self.waiting:
+                    waiting_hashes.difference_update(upserts)
+                    if waiting_hashes:
+                        still_waiting.append((file_id, file_section_id, waiting_hashes))
+                    else:
+                        self.ready.append((file_id, file_section_id))
+                self.waiting = still_waiting
+        self.write_checkpoints()
+
+    def write_checkpoints(self):
+        # Checkpoints become ready in flush order and every write takes all the ready ones, so they are committed in
+        # order without holding up the next flush while the database write runs
+        with self.checkpoint_lock:
+            with self.buffer_lock:
+                ready, self.ready = self.ready, []
+            if not ready:
+                return
+            try:
+                self.checkpoint(
+                    [file_section_id for _, file_section_id in ready if file_section_id is not None],
+                    [file_id for file_id, file_section_id in ready if file_section_id is None],
+                )
+            except Exception as ex:
+                logging.error(f"Unable to checkpoint {len(ready)} sections and files, the files fail: {ex}")
+                with self.buffer_lock:
+                    self.fail_files({file_id for file_id, _ in ready})
+
+    def __enter__(self):
+        return self
 
-def delete_file_section_embeddings(project_id: UUID, file_section_id: UUID):
-    get_file_section_collection(project_id).delete(ids=[str(file_section_id)])
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
@@ -1,25 +1,74 @@
 import os
+from concurrent.futures import Future
 from contextlib import contextmanager
+from queue import Queue
+from threading import Lock, Thread
+from typing import Callable, List, Optional, TypeVar
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session as OrmSession
 from sqlalchemy.orm import sessionmaker
 
 from core.config import BASE_DIR
 
 DATABASE_FILE_PATH = os.path.join(BASE_DIR, "database.db")
 
+READ_POOL_SIZE = 4
+BUSY_TIMEOUT_SECONDS = 30
+
+T = TypeVar("T")
+
 Base = declarative_base()
 
-engine = create_engine(f"sqlite:///{DATABASE_FILE_PATH}")
+engine = create_engine(f"sqlite:///{DATABASE_FILE_PATH}", connect_args={"timeout": BUSY_TIMEOUT_SECONDS})
+read_engine = create_engine(
+    f"sqlite:///file:{DATABASE_FILE_PATH}?mode=ro&uri=true",
+    connect_args={"timeout": BUSY_TIMEOUT_SECONDS},
+    pool_size=READ_POOL_SIZE,
+    max_overflow=READ_POOL_SIZE,
+)
 Session = sessionmaker(bind=engine)
+ReadSession = sessionmaker(bind=read_engine)
+
+
+@event.listens_for(engine, "connect")
+def enable_write_ahead_log(dbapi_connection, connection_record):
+    # Readers never block the writer (and the other way around) in WAL mode
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+def create_tables_if_not_exists() -> List[str]:
+    """Create the missing tables and add the columns missing from the existing ones.
 
-def create_tables_if_not_exists():
+    Returns:
+        List[str]: the `table.column` names that were added to existing tables
+    """
     Base.metadata.create_all(bind=engine)
+    return add_missing_columns()
+
+def add_missing_columns() -> List[str]:
+    # `create_all` never alters existing tables, so columns added to a model after its table was created are added here
+    added_columns = []
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {row[1] for row in connection.execute(text(f"PRAGMA table_info({table.name})"))}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                # Table and column names come from the models, never from user input
+                statement = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                connection.execute(text(statement))  # nosec B608
+                added_columns.append(f"{table.name}.{column.name}")
+            if any(name.startswith(f"{table.name}.") for name in added_columns):
+                for index in table.indexes:
+                    index.create(bind=connection, checkfirst=True)
+    return added_columns
 
 @contextmanager
 def read_only_session():
-    session = Session()
+    session = ReadSession()
     try:
         yield session
     finally:
@@ -37,3 +86,45 @@ def read_write_session():
         raise
     finally:
         session.close()
+
+
+class DatabaseWriter:
+    """Owns the write connection and applies the mutations submitted from any thread, one transaction at a time.
+
+    Concurrent threads (e.g. the indexing workers) submit their writes here instead of opening their own
+    `read_write_session`, so writes are serialized in the process and never fail with "database is locked".
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+        self.thread: Optional[Thread] = None
+        self.lock = Lock()
+
+    def submit(self, mutation: Callable[[OrmSession], T]) -> "Future[T]":
+        future = Future()
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name="database-writer", daemon=True)
+                self.thread.start()
+        self.queue.put((mutation, future))
+        return future
+
+    def run(self):
+        while True:
+            mutation, future = self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with read_write_session() as session:
+                    result = mutation(session)
+                future.set_result(result)
+            except Exception as ex:
+                future.set_exception(ex)
+
+
+database_writer = DatabaseWriter()
+
+
+def write(mutation: Callable[[OrmSession], T]) -> T:
+    """Run a mutation on the writer thread and wait for it to be committed."""
+    return database_writer.submit(mutation).result()
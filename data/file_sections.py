@@ -2,7 +2,7 @@
 import uuid
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, ForeignKey, String
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
 from sqlalchemy_utils import UUIDType
 
 from data.database import Base
@@ -14,4 +14,7 @@ class FileSection(Base):
     id = Column(UUIDType(binary=False), primary_key=True, default=uuid.uuid4)
     file_id = Column(UUIDType(binary=False), ForeignKey("files.id"))
     content = Column(String)
+    content_hash = Column(String, index=True)
+    position = Column(Integer, nullable=True)
+    index_id = Column(UUIDType(binary=False), ForeignKey("indexes.id"), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
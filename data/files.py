@@ -17,6 +17,7 @@ class File(Base):
     path = Column(String, unique=True)
     checksum = Column(String)
     index_id = Column(UUIDType(binary=False), ForeignKey("indexes.id"))
+    completed_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     file_sections = relationship("FileSection", cascade="all,delete-orphan")
@@ -16,3 +16,5 @@ class Index(Base):
     end_at = Column(DateTime, nullable=True)
     indexed = Column(Integer, default=0, nullable=True)
     skipped = Column(Integer, default=0, nullable=True)
+    duplicates = Column(Integer, default=0, nullable=True)
+    dropped = Column(Integer, default=0, nullable=True)
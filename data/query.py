@@ -1,39 +1,150 @@
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import AbstractSet, List, Optional, Tuple
 from uuid import UUID
 
+import numpy as np
 from pydantic import BaseModel
-from sqlalchemy.orm import joinedload
 
 from data.chroma import get_file_section_collection
 from data.database import read_only_session
 from data.file_sections import FileSection
 from data.files import File
 
+MATCH_COUNT = 10
+CANDIDATE_COUNT = 40
+MMR_LAMBDA = 0.7
+
 
 class MatchResult(BaseModel):
+    project_id: UUID
+    content_hashes: List[str]
     path: str
+    paths: List[str]
     similarity: float
     content: str
+    position: Optional[int] = None
 
-def match_file_sections(project_id: UUID, query_embedding) -> List[MatchResult]:
-    results = get_file_section_collection(project_id).query(
-        query_embeddings=[query_embedding],
-        n_results=10,
-        include=["distances"])
 
-    query_results = [{'id': UUID(id), 'similarity': 1 - distance}
-                    for id, distance in zip(results['ids'][0], results['distances'][0])]
+class MatchCandidate(BaseModel):
+    project_id: UUID
+    content_hash: str
+    embedding: List[float]
+
+
+def match_file_sections_across_projects(
+    project_ids: List[UUID], query_embedding, excluded_sections: AbstractSet[Tuple[UUID, str]] = frozenset()
+) -> List[MatchResult]:
+    """Search the collections of all projects concurrently and pick a relevant but diverse set of sections.
+
+    Each collection is over-fetched, the candidates are reranked together with maximal marginal relevance,
+    and adjacent sections of the same file are merged into a single match. Sections in `excluded_sections`
+    (`(project_id, content_hash)` pairs, e.g. the ones already sent in a conversation) are never picked.
+    """
+    with ThreadPoolExecutor(max_workers=len(project_ids)) as executor:
+        project_candidates = executor.map(lambda project_id: query_candidates(project_id, query_embedding), project_ids)
+        candidates = [
+            candidate
+            for candidates in project_candidates
+            for candidate in candidates
+            if (candidate.project_id, candidate.content_hash) not in excluded_sections
+        ]
+    if not candidates:
+        return []
+
+    embeddings = normalize(np.asarray([candidate.embedding for candidate in candidates], dtype=np.float32))
+    query = normalize(np.asarray([query_embedding], dtype=np.float32))[0]
+    relevance = embeddings @ query
+    selected = maximal_marginal_relevance(relevance, embeddings, MATCH_COUNT, MMR_LAMBDA)
 
     matches = []
     with read_only_session() as session:
-        for result in query_results:
-            file_section = session.query(FileSection).get(result['id'])
-            if file_section:
-                file = session.query(File).options(joinedload(File.file_sections)).get(file_section.file_id)
-                final_result = MatchResult(
-                    path=file.path,
-                    similarity=result['similarity'],
-                    content=file_section.content
-                )
-                matches.append(final_result)
-    return matches
+        for index in selected:
+            match = resolve_candidate(session, candidates[index], float(relevance[index]))
+            if match:
+                matches.append(match)
+    return merge_adjacent_matches(matches)
+
+
+def query_candidates(project_id: UUID, query_embedding) -> List[MatchCandidate]:
+    results = get_file_section_collection(project_id).query(
+        query_embeddings=[query_embedding],
+        n_results=CANDIDATE_COUNT,
+        include=["embeddings"])
+    return [MatchCandidate(project_id=project_id, content_hash=content_hash, embedding=embedding)
+            for content_hash, embedding in zip(results['ids'][0], results['embeddings'][0])]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def maximal_marginal_relevance(
+    relevance: np.ndarray, embeddings: np.ndarray, count: int, lambda_mult: float
+) -> List[int]:
+    """Greedily pick the candidates that are most relevant to the query and least similar to the ones already picked.
+
+    Args:
+        relevance (np.ndarray): cosine similarity of every candidate to the query
+        embeddings (np.ndarray): normalized candidate embeddings, one per row
+        count (int): number of candidates to pick
+        lambda_mult (float): trade-off between relevance (1) and diversity (0)
+
+    Returns:
+        List[int]: indexes of the picked candidates, in order of selection
+    """
+    similarity = embeddings @ embeddings.T
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    while len(selected) < min(count, len(relevance)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+
+def resolve_candidate(session, candidate: MatchCandidate, similarity: float) -> Optional[MatchResult]:
+    # Identical sections share one embedding, so a single hit can point at several files
+    rows = (
+        session.query(File.path, FileSection.content, FileSection.position)
+        .join(FileSection, FileSection.file_id == File.id)
+        .filter(File.project_id == candidate.project_id, FileSection.content_hash == candidate.content_hash)
+        .order_by(File.path)
+        .all()
+    )
+    if not rows:
+        return None
+    paths = list(dict.fromkeys(row.path for row in rows))
+    return MatchResult(
+        project_id=candidate.project_id,
+        content_hashes=[candidate.content_hash],
+        path=rows[0].path,
+        paths=paths,
+        similarity=similarity,
+        content=rows[0].content,
+        position=rows[0].position,
+    )
+
+
+def merge_adjacent_matches(matches: List[MatchResult]) -> List[MatchResult]:
+    """Merge matches that are consecutive sections of the same file and order them by similarity."""
+    merged = []
+    for match in sorted(matches, key=lambda match: (match.path, match.position if match.position is not None else -1)):
+        previous = merged[-1] if merged else None
+        if (
+            previous is not None
+            and previous.project_id == match.project_id
+            and previous.path == match.path
+            and previous.position is not None
+            and match.position == previous.position + 1
+        ):
+            previous.content += match.content
+            previous.content_hashes = previous.content_hashes + match.content_hashes
+            previous.similarity = max(previous.similarity, match.similarity)
+            previous.paths = [path for path in previous.paths if path in match.paths]
+            previous.position = match.position
+        else:
+            merged.append(match.copy())
+    return sorted(merged, key=lambda match: match.similarity, reverse=True)
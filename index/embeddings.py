@@ -1,43 +1,150 @@
-
 import logging
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
 from multiprocessing import Value
-from typing import List
+from typing import List, Set
 
+from pydantic import BaseModel
 from rich.console import Console
 from tqdm import tqdm
 
-from data.chroma import create_file_section_embeddings
-from index.file_processor import Chunk
-from repository.file_sections import create_file_sections
-from repository.files import create_or_update_file, delete_files_from_previous_index
+from data.chroma import (FileSectionEmbeddingWriter,
+                         create_file_section_embeddings,
+                         get_file_section_embedding_ids)
+from index.file_processor import Chunk, content_hash
+from repository.file_sections import (checkpoint_file_sections,
+                                      create_file_sections,
+                                      delete_stale_file_sections,
+                                      get_embedded_content_hashes,
+                                      get_referenced_content_hashes)
+from repository.files import (create_or_update_file,
+                              delete_files_from_previous_index,
+                              get_completed_files)
 
 console = Console()
 
-def create_embeddings_for_chunks(project_id: str, index_id: str, chunks: List[Chunk]):
-    total_chunks = len(chunks)
+
+class EmbeddingResult(BaseModel):
+    duplicates: int
+    reused: int
+    dropped: int
+
+
+def create_embeddings_for_chunks(project_id: str, index_id: str, chunks: List[Chunk]) -> EmbeddingResult:
+    """Create the embeddings for all chunks, counting the duplicate sections skipped and the files that failed.
+
+    Duplicates are the sections sharing their content with another section embedded during this run, the sections
+    whose embedding was already stored by a previous run (e.g. unchanged files) are counted as reused instead.
+
+    Files already completed during this index (e.g. by an interrupted run) are skipped, so the index can be resumed.
+    """
+    completed_files = get_completed_files(project_id, index_id)
+    pending_chunks = [chunk for chunk in chunks if (chunk.file_path, chunk.checksum) not in completed_files]
+    if len(pending_chunks) < len(chunks):
+        console.print(f"Skipping {len(chunks) - len(pending_chunks)} files already indexed")
+    total_chunks = len(pending_chunks)
     files_left = Value("i", total_chunks)
+    duplicates = Value("i", 0)
+    reused = Value("i", 0)
+    dropped = Value("i", 0)
+    embedded_hashes = get_file_section_embedding_ids(project_id)
     console.print(f"Creating embeddings for {total_chunks} chunks")
     progress_bar = tqdm(total=total_chunks, desc="Indexing", position=0, leave=True)
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        [executor.submit(index_chunks, project_id, index_id, chunk, files_left, progress_bar) for chunk in chunks]
-    progress_bar.close()
-    console.print("Embeddings created and files indexed.")
+    writer = FileSectionEmbeddingWriter(project_id, partial(checkpoint_file_sections, index_id))
+    executor = ThreadPoolExecutor(max_workers=4)
+    futures = [
+        executor.submit(
+            index_chunks, project_id, index_id, chunk, files_left, progress_bar,
+            embedded_hashes, duplicates, reused, dropped, writer
+        )
+        for chunk in pending_chunks
+    ]
+    try:
+        wait(futures)
+    except KeyboardInterrupt:
+        for future in futures:
+            future.cancel()
+        console.print("Indexing interrupted. Run `gpt-code-assistant resume <project-name>` to continue.")
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        # Persist every embedding already paid for, even when interrupted
+        writer.flush()
+        progress_bar.close()
+    console.print(
+        f"Embeddings created and files indexed. Skipped {duplicates.value} duplicate sections "
+        f"and reused {reused.value} sections already embedded."
+    )
+    # Files failed by the writer include the ones whose shared embedding could not be created by another file
+    dropped_files = dropped.value + len(writer.failed_files)
+    if dropped_files > 0:
+        console.print(f"{dropped_files} files could not be indexed, see the errors above.", style="bold red")
+    delete_files_from_previous_index(project_id, index_id)
+    # Embeddings are shared by every section with the same content, only drop the ones nothing references anymore.
+    # Sweeping the whole collection also drops the ones left behind by an interrupted run once it completes.
+    referenced_hashes = get_referenced_content_hashes(project_id)
+    for unreferenced_hash in get_file_section_embedding_ids(project_id) - referenced_hashes:
+        writer.delete(unreferenced_hash)
+    writer.flush()
+    return EmbeddingResult(duplicates=duplicates.value, reused=reused.value, dropped=dropped_files)
 
-def index_chunks(project_id: str, index_id: str, chunk: Chunk, files_left: Value, progress_bar):
+def index_chunks(
+    project_id: str,
+    index_id: str,
+    chunk: Chunk,
+    files_left: Value,
+    progress_bar,
+    embedded_hashes: Set[str],
+    duplicates: Value,
+    reused: Value,
+    dropped: Value,
+    writer: FileSectionEmbeddingWriter,
+):
     """Function to index chunks in parallel. This happens in two phases:
 
     1. Create/modify/delete the files as needed in the database and wait for generating the embeddings.
-    2. Generate the embeddings as necessary and store them in the local chroma db.
+    2. Generate the embeddings as necessary and store them in the local chroma db. Sections are keyed by the
+       hash of their content, so identical sections across files are only embedded and stored once. The hashes
+       already stored (`embedded_hashes`) are loaded once per run instead of looking up every section.
+
+    Sections the file no longer contains are deleted, their embeddings are only dropped at the end of the run once
+    nothing references them anymore. Embeddings go through the buffered writer, and every embedded section and
+    every completed file is checkpointed against the index once the batch holding its embedding has been written.
     """
+    file_id = None
     try:
         file_id = create_or_update_file(project_id, index_id, chunk.file_path, chunk.checksum)
-        for section in chunk.sections:
-            file_section_id = create_file_sections(file_id, section)
-            create_file_section_embeddings(project_id, file_section_id, section)
-        delete_files_from_previous_index(project_id, index_id)
+        delete_stale_file_sections(file_id, {content_hash(section) for section in chunk.sections})
+        checkpointed_hashes = get_embedded_content_hashes(file_id, index_id)
+        file_hashes = set()
+        for position, section in enumerate(chunk.sections):
+            section_hash = content_hash(section)
+            if section_hash in checkpointed_hashes:
+                continue
+            file_section_id = create_file_sections(file_id, section, section_hash, position)
+            if section_hash in embedded_hashes:
+                with reused.get_lock():
+                    reused.value += 1
+            elif not writer.claim(section_hash):
+                with duplicates.get_lock():
+                    duplicates.value += 1
+            else:
+                try:
+                    create_file_section_embeddings(writer, section_hash, section)
+                except Exception:
+                    writer.release(section_hash)
+                    raise
+            # A duplicate may still wait on the section that claimed its embedding
+            writer.checkpoint_section(file_id, file_section_id, section_hash)
+            file_hashes.add(section_hash)
+        writer.complete_file(file_id, file_hashes)
     except Exception as ex:
-        logging.info(f"Error occurred during embedding creation and indexing: {str(ex)}")
+        logging.error(f"Error occurred during embedding creation and indexing of {chunk.file_path}: {str(ex)}")
+        if file_id is None:
+            with dropped.get_lock():
+                dropped.value += 1
+        else:
+            writer.fail_file(file_id)
     finally:
         with files_left.get_lock():
             files_left.value -= 1
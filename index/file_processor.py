@@ -53,6 +53,9 @@ def source_files(project: Project) -> List[str]:
     logging.debug(f"Total number of files: {len(file_paths)}")
     return file_paths
 
+def content_hash(content: str) -> str:
+    return sha256(content.encode("utf-8")).hexdigest()
+
 def chunk_source_files(src_files: List[str]) -> ChunkResult:
     chunks = []
     skipped = 0
@@ -64,7 +67,7 @@ def chunk_source_files(src_files: List[str]) -> ChunkResult:
         try:
             with open(file_path, "r", encoding="utf-8") as file:
                 content = file.read()
-                checksum = sha256(content.encode("utf-8")).hexdigest()
+                checksum = content_hash(content)
                 sections = chunk_source(content)
                 if len(sections) > 0:
                     chunk = Chunk(checksum=checksum, file_path=file_path, sections=sections)
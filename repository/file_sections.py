@@ -1,14 +1,77 @@
+from datetime import datetime
+from typing import List, Set
 
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
 
-from data.database import read_write_session
+from data.database import read_only_session, write
 from data.file_sections import FileSection
+from data.files import File
 
+QUERY_BATCH_SIZE = 500
 
-def create_file_sections(file_id: str, content: str) -> str:
-    with read_write_session() as session:
-        file_section = session.query(FileSection).filter(FileSection.file_id == file_id).first()
-        if not file_section:
-            file_section = FileSection(file_id=file_id, content=content)
+
+def create_file_sections(file_id: str, content: str, content_hash: str, position: int) -> str:
+    def upsert_file_section(session: Session) -> str:
+        file_section = (
+            session.query(FileSection)
+            .filter(FileSection.file_id == file_id, FileSection.content_hash == content_hash)
+            .first()
+        )
+        if file_section:
+            file_section.position = position
+        else:
+            file_section = FileSection(file_id=file_id, content=content, content_hash=content_hash, position=position)
             session.add(file_section)
-        session.commit()
+        session.flush()
         return file_section.id
+
+    return write(upsert_file_section)
+
+
+def get_embedded_content_hashes(file_id: str, index_id: str) -> Set[str]:
+    """Content hashes of the sections of a file whose embedding was already persisted during this index."""
+    with read_only_session() as session:
+        rows = session.query(FileSection.content_hash).filter(
+            FileSection.file_id == file_id, FileSection.index_id == index_id
+        )
+        return {content_hash for (content_hash,) in rows}
+
+
+def checkpoint_file_sections(index_id: str, file_section_ids: List[str], file_ids: List[str]):
+    """Checkpoint the embedded sections and the completed files for this index in a single transaction.
+
+    A resumed run skips the completed files and the sections already embedded in the other files.
+    """
+    def checkpoint(session: Session):
+        for start in range(0, len(file_section_ids), QUERY_BATCH_SIZE):
+            session.query(FileSection).filter(
+                FileSection.id.in_(file_section_ids[start:start + QUERY_BATCH_SIZE])
+            ).update({FileSection.index_id: index_id}, synchronize_session=False)
+        completed_at = datetime.utcnow()
+        for start in range(0, len(file_ids), QUERY_BATCH_SIZE):
+            session.query(File).filter(File.id.in_(file_ids[start:start + QUERY_BATCH_SIZE])).update(
+                {File.completed_at: completed_at}, synchronize_session=False
+            )
+
+    write(checkpoint)
+
+
+def delete_stale_file_sections(file_id: str, content_hashes: Set[str]):
+    """Delete the sections of a file that are no longer part of its content."""
+    write(lambda session: session.query(FileSection).filter(
+        FileSection.file_id == file_id,
+        or_(FileSection.content_hash.is_(None), FileSection.content_hash.notin_(content_hashes)),
+    ).delete(synchronize_session=False))
+
+
+def get_referenced_content_hashes(project_id: str) -> Set[str]:
+    """Content hashes referenced by the sections of the project, the embeddings of any other hash can be deleted."""
+    with read_only_session() as session:
+        rows = (
+            session.query(FileSection.content_hash)
+            .join(File, File.id == FileSection.file_id)
+            .filter(File.project_id == project_id, FileSection.content_hash.isnot(None))
+            .distinct()
+        )
+        return {content_hash for (content_hash,) in rows}
@@ -1,17 +1,21 @@
 
 
-from typing import Optional
+from typing import Optional, Set, Tuple
 
-from data.chroma import delete_file_section_embeddings
-from data.database import read_only_session, read_write_session
+from sqlalchemy.orm import Session
+
+from data.database import read_only_session, write
 from data.file_sections import FileSection
 from data.files import File
+from repository.file_sections import QUERY_BATCH_SIZE
 
 
 def create_or_update_file(project_id: str, index_id: str, file_path: str, checksum: str) -> str:
-    with read_write_session() as session:
+    def upsert_file(session: Session) -> str:
         file = session.query(File).filter(File.path == file_path).first()
         if file:
+            if file.index_id != index_id or file.checksum != checksum:
+                file.completed_at = None
             file.project_id = project_id
             file.index_id = index_id
             file.checksum = checksum
@@ -23,22 +27,36 @@ def create_or_update_file(project_id: str, index_id: str, file_path: str, checks
                 checksum=checksum,
             )
             session.add(file)
-        session.commit()
+        session.flush()
         return file.id
 
+    return write(upsert_file)
+
+def get_completed_files(project_id: str, index_id: str) -> Set[Tuple[str, str]]:
+    """Paths and checksums of the files already fully indexed during this index."""
+    with read_only_session() as session:
+        rows = session.query(File.path, File.checksum).filter(
+            File.project_id == project_id, File.index_id == index_id, File.completed_at.isnot(None)
+        )
+        return {(path, checksum) for path, checksum in rows}
+
 def get_file(file_path) -> Optional[File]:
     with read_only_session() as session:
         return session.query(File).filter(File.path == file_path).first()
 
 
 def delete_files_from_previous_index(project_id: str, current_index_id: str):
-    with read_write_session() as session:
-        files = session.query(File).filter(File.project_id == project_id, File.index_id != current_index_id).all()
-        file_ids = [file.id for file in files]
-        file_sections = session.query(FileSection).filter(FileSection.file_id.in_(file_ids)).all()
-        file_section_ids = [file_section.id for file_section in file_sections]
-        session.query(File).filter(File.id.in_(file_ids)).delete(synchronize_session=False)
-        for file_section_id in file_section_ids:
-            delete_file_section_embeddings(project_id, file_section_id)
-        session.query(FileSection).filter(FileSection.id.in_(file_section_ids)).delete(synchronize_session=False)
-        session.commit()
+    """Delete the files that were not part of the current index and their sections."""
+    def delete_files(session: Session):
+        file_ids = [
+            file_id
+            for (file_id,) in session.query(File.id).filter(
+                File.project_id == project_id, File.index_id != current_index_id
+            )
+        ]
+        for start in range(0, len(file_ids), QUERY_BATCH_SIZE):
+            batch_ids = file_ids[start:start + QUERY_BATCH_SIZE]
+            session.query(FileSection).filter(FileSection.file_id.in_(batch_ids)).delete(synchronize_session=False)
+            session.query(File).filter(File.id.in_(batch_ids)).delete(synchronize_session=False)
+
+    write(delete_files)
@@ -1,7 +1,8 @@
 
 from datetime import datetime
+from typing import Optional
 
-from data.database import read_write_session
+from data.database import read_only_session, read_write_session
 from data.indexes import Index
 from data.projects import Project
 
@@ -14,11 +15,27 @@ def start_indexing(project: Project):
         session.commit()
         return index.id
 
-def complete_indexing(index_id: str, indexed: int, skipped: int):
+def complete_indexing(index_id: str, indexed: int, skipped: int, duplicates: int = 0, dropped: int = 0):
     """Complete indexing the project."""
     with read_write_session() as session:
         index = session.query(Index).filter(Index.id == index_id).first()
         index.end_at = datetime.utcnow()
         index.indexed = indexed
         index.skipped = skipped
+        index.duplicates = duplicates
+        index.dropped = dropped
         session.commit()
+
+
+def get_unfinished_index(project: Project) -> Optional[Index]:
+    """Get the latest index of the project if it never completed."""
+    with read_only_session() as session:
+        index = (
+            session.query(Index)
+            .filter(Index.project_id == project.id)
+            .order_by(Index.start_at.desc())
+            .first()
+        )
+        if index and index.end_at is None:
+            return index
+        return None
@@ -1,6 +1,7 @@
 
 
-from typing import Optional
+import fnmatch
+from typing import List, Optional
 
 from rich.console import Console
 from rich.table import Table
@@ -10,7 +11,7 @@ from data.database import read_only_session, read_write_session
 from data.projects import Project
 from index.embeddings import create_embeddings_for_chunks
 from index.file_processor import chunk_source_files, source_files
-from repository.indexes import complete_indexing, start_indexing
+from repository.indexes import complete_indexing, get_unfinished_index, start_indexing
 
 console = Console()
 
@@ -33,6 +34,27 @@ def get_project_by_name(name: str) -> Optional[Project]:
             return None
 
 
+def get_projects_by_pattern(pattern: str) -> List[Project]:
+    """Get all projects matching a comma separated list of names or glob patterns.
+
+    Args:
+        pattern (str): project names or glob patterns, e.g. `api,web` or `service-*`
+
+    Returns:
+        List[Project]: matching projects, empty if none matches
+    """
+    patterns = [part.strip() for part in pattern.split(",") if part.strip()]
+    with read_only_session() as session:
+        projects = [
+            project
+            for project in session.query(Project).order_by(Project.name).all()
+            if any(fnmatch.fnmatchcase(project.name, part) for part in patterns)
+        ]
+        if not projects:
+            console.print(f"No project matches - {pattern}.")
+        return projects
+
+
 def list_all_projects():
     """List all projects created."""
     with read_only_session() as session:
@@ -117,14 +139,39 @@ def reindex_project(name: str):
         else:
             console.print(f"Project - {name} does not exist.")
 
-def index_project(project: Project):
+def resume_project(name: str):
+    """ Resume the latest unfinished index of a project, skipping the work that was already persisted.
+
+    Args:
+        name (str): Project name
+    """
+    project = get_project_by_name(name)
+    if project is None:
+        return
+    index = get_unfinished_index(project)
+    if index is None:
+        console.print(f"Project - {project.name} has no unfinished index to resume.")
+        return
+    console.print(f"Resuming index started at {index.start_at.strftime('%B %d, %Y, %I:%M %p')}")
+    index_project(project, index.id)
+
+
+def index_project(project: Project, index_id: Optional[str] = None):
     """ Start indexing the project.
 
     Args:
         project (Projects): project to index
+        index_id (str, optional): unfinished index to resume instead of starting a new one
     """
     console.print(f"Indexing - {project.name} at {project.path}")
-    index_id = start_indexing(project)
+    if index_id is None:
+        index_id = start_indexing(project)
     chunk_result = chunk_source_files(source_files(project))
-    create_embeddings_for_chunks(project.id, index_id, chunk_result.chunks)
-    complete_indexing(index_id, chunk_result.indexed, chunk_result.skipped)
+    embedding_result = create_embeddings_for_chunks(project.id, index_id, chunk_result.chunks)
+    complete_indexing(
+        index_id,
+        chunk_result.indexed - embedding_result.dropped,
+        chunk_result.skipped,
+        embedding_result.duplicates,
+        embedding_result.dropped,
+    )
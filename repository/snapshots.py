@@ -0,0 +1,215 @@
+import json
+import os
+import uuid
+import zipfile
+from datetime import datetime
+from io import BytesIO
+from typing import List, Optional
+
+import numpy as np
+from rich.console import Console
+
+from data.chroma import get_file_section_collection
+from data.database import read_only_session, read_write_session
+from data.file_sections import FileSection
+from data.files import File
+from data.indexes import Index
+from data.projects import Project
+from repository.file_sections import QUERY_BATCH_SIZE
+from repository.indexes import get_unfinished_index
+from repository.projects import delete_project, get_project_by_name
+
+console = Console()
+
+SNAPSHOT_FORMAT = "gpt-code-assistant-index"
+SNAPSHOT_VERSION = 1
+CHROMA_BATCH_SIZE = 5000
+FILE_KEYS = ("path", "checksum")
+SECTION_KEYS = ("file", "content", "content_hash", "position")
+
+
+def export_project_index(name: str, output_path: str):
+    """ Export the files, sections and embeddings of a project to a single snapshot file.
+
+    The snapshot is a zip archive holding a versioned manifest, the files and sections as deflated JSON and the
+    embeddings as a raw float32 numpy array, so it can be imported without calling the embeddings API.
+
+    Args:
+        name (str): Project name
+        output_path (str): path of the snapshot file to write
+    """
+    project = get_project_by_name(name)
+    if project is None:
+        return
+    if get_unfinished_index(project) is not None:
+        console.print(f"Project - {project.name} has an unfinished index, the snapshot will be incomplete.")
+
+    with read_only_session() as session:
+        files = session.query(File).filter(File.project_id == project.id).order_by(File.path).all()
+        file_positions = {file.id: position for position, file in enumerate(files)}
+        file_sections = (
+            session.query(FileSection)
+            .join(File, File.id == FileSection.file_id)
+            .filter(File.project_id == project.id)
+            .order_by(FileSection.file_id, FileSection.position)
+            .all()
+        )
+
+    content_hashes = sorted({file_section.content_hash for file_section in file_sections if file_section.content_hash})
+    collection = get_file_section_collection(project.id)
+    embedding_ids = []
+    embeddings = []
+    for start in range(0, len(content_hashes), CHROMA_BATCH_SIZE):
+        result = collection.get(ids=content_hashes[start:start + CHROMA_BATCH_SIZE], include=["embeddings"])
+        embedding_ids.extend(result["ids"])
+        embeddings.extend(result["embeddings"])
+    vectors = np.asarray(embeddings, dtype=np.float32)
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "project": {"name": project.name, "path": project.path},
+        "files": len(files),
+        "sections": len(file_sections),
+        "embeddings": len(embedding_ids),
+        "dimensions": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+        "exported_at": datetime.utcnow().isoformat(),
+    }
+    exported_files = [{"path": os.path.relpath(file.path, project.path), "checksum": file.checksum} for file in files]
+    exported_sections = [
+        {
+            "file": file_positions[file_section.file_id],
+            "content": file_section.content,
+            "content_hash": file_section.content_hash,
+            "position": file_section.position,
+        }
+        for file_section in file_sections
+    ]
+    vectors_buffer = BytesIO()
+    np.save(vectors_buffer, vectors, allow_pickle=False)
+
+    with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_DEFLATED) as snapshot:
+        snapshot.writestr("manifest.json", json.dumps(manifest, indent=2))
+        snapshot.writestr("files.json", json.dumps(exported_files))
+        snapshot.writestr("sections.json", json.dumps(exported_sections))
+        snapshot.writestr("embedding_ids.json", json.dumps(embedding_ids))
+        # Floats barely compress, storing them keeps the import a plain memory copy
+        snapshot.writestr("embeddings.npy", vectors_buffer.getvalue(), compress_type=zipfile.ZIP_STORED)
+    console.print(
+        f"Exported {len(files)} files, {len(file_sections)} sections and {len(embedding_ids)} embeddings "
+        f"of project - {project.name} to {output_path}"
+    )
+
+
+def import_project_index(input_path: str, path: str, name: Optional[str] = None):
+    """ Create a project from a snapshot written by `export_project_index` without calling the embeddings API.
+
+    Args:
+        input_path (str): path of the snapshot file
+        path (str): path of the codebase on this machine, the file paths of the snapshot are relative to it
+        name (str, optional): project name, defaults to the name of the exported project
+    """
+    try:
+        with zipfile.ZipFile(input_path, "r") as snapshot:
+            manifest = json.loads(snapshot.read("manifest.json"))
+            if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(
+                    f"Unsupported snapshot {input_path}: expected {SNAPSHOT_FORMAT} version {SNAPSHOT_VERSION}, "
+                    f"got {manifest.get('format')} version {manifest.get('version')}."
+                )
+            exported_files = json.loads(snapshot.read("files.json"))
+            exported_sections = json.loads(snapshot.read("sections.json"))
+            embedding_ids = json.loads(snapshot.read("embedding_ids.json"))
+            vectors = np.load(BytesIO(snapshot.read("embeddings.npy")), allow_pickle=False)
+            name = name or manifest["project"]["name"]
+    except (zipfile.BadZipFile, KeyError, json.JSONDecodeError) as ex:
+        raise ValueError(f"Invalid snapshot {input_path}: {ex}") from ex
+    if len(embedding_ids) != len(vectors):
+        raise ValueError(
+            f"Invalid snapshot {input_path}: {len(embedding_ids)} embedding ids for {len(vectors)} embeddings."
+        )
+    validate_snapshot_rows(input_path, exported_files, exported_sections)
+    file_paths = [os.path.join(path, exported_file["path"]) for exported_file in exported_files]
+    if len(set(file_paths)) != len(file_paths):
+        raise ValueError(f"Invalid snapshot {input_path}: some files share the same path.")
+
+    with read_write_session() as session:
+        existing = session.query(Project).filter((Project.name == name) | (Project.path == path)).first()
+        if existing:
+            console.print(f"Project - {existing.name} already exists at {existing.path}.")
+            return
+        # File paths are unique across projects, e.g. when another project indexes a parent directory
+        for start in range(0, len(file_paths), QUERY_BATCH_SIZE):
+            existing_file = session.query(File).filter(
+                File.path.in_(file_paths[start:start + QUERY_BATCH_SIZE])
+            ).first()
+            if existing_file:
+                console.print(f"File - {existing_file.path} is already indexed by another project.")
+                return
+
+        console.print(f"Importing project - {name} at {path}")
+        project = Project(name=name, path=path)
+        session.add(project)
+        session.flush()
+        project_id = project.id
+        now = datetime.utcnow()
+        index = Index(project_id=project.id, start_at=now, end_at=now, indexed=len(exported_files), skipped=0)
+        session.add(index)
+        session.flush()
+
+        file_ids = [uuid.uuid4() for _ in exported_files]
+        session.bulk_insert_mappings(File, [
+            {
+                "id": file_id,
+                "project_id": project.id,
+                "path": file_path,
+                "checksum": exported_file["checksum"],
+                "index_id": index.id,
+                "completed_at": now,
+            }
+            for file_id, file_path, exported_file in zip(file_ids, file_paths, exported_files)
+        ])
+        session.bulk_insert_mappings(FileSection, [
+            {
+                "id": uuid.uuid4(),
+                "file_id": file_ids[exported_section["file"]],
+                "content": exported_section["content"],
+                "content_hash": exported_section["content_hash"],
+                "position": exported_section["position"],
+                "index_id": index.id,
+            }
+            for exported_section in exported_sections
+        ])
+        session.commit()
+
+    # The rows are committed first so that a failing commit never leaves an orphan collection behind
+    try:
+        collection = get_file_section_collection(project_id)
+        for start in range(0, len(embedding_ids), CHROMA_BATCH_SIZE):
+            collection.upsert(
+                ids=embedding_ids[start:start + CHROMA_BATCH_SIZE],
+                embeddings=vectors[start:start + CHROMA_BATCH_SIZE].tolist(),
+            )
+    except Exception:
+        console.print(f"Unable to import the embeddings, removing project - {name}.")
+        delete_project(name)
+        raise
+    console.print(
+        f"Imported {len(exported_files)} files, {len(exported_sections)} sections and {len(embedding_ids)} embeddings "
+        f"into project - {name}."
+    )
+
+
+def validate_snapshot_rows(input_path: str, exported_files: List[dict], exported_sections: List[dict]):
+    """Check the files and sections of a snapshot before inserting any of them, raising a ValueError if invalid."""
+    for position, exported_file in enumerate(exported_files):
+        if not isinstance(exported_file, dict) or any(key not in exported_file for key in FILE_KEYS):
+            raise ValueError(f"Invalid snapshot {input_path}: file {position} must have the keys {FILE_KEYS}.")
+        if not isinstance(exported_file["path"], str):
+            raise ValueError(f"Invalid snapshot {input_path}: file {position} has no valid path.")
+    for position, exported_section in enumerate(exported_sections):
+        if not isinstance(exported_section, dict) or any(key not in exported_section for key in SECTION_KEYS):
+            raise ValueError(f"Invalid snapshot {input_path}: section {position} must have the keys {SECTION_KEYS}.")
+        file = exported_section["file"]
+        if isinstance(file, bool) or not isinstance(file, int) or not 0 <= file < len(exported_files):
+            raise ValueError(f"Invalid snapshot {input_path}: section {position} refers to an unknown file {file!r}.")